@@ -1,9 +1,10 @@
 '''FITS file and data reader'''
 
 import mmap
-import math
+import os
 import re
-from weakref import finalize
+from functools import lru_cache
+from operator import itemgetter
 
 import numpy as np
 
@@ -13,7 +14,9 @@ from .header import HDUError, read_header
 class HduArray(np.ndarray):
 
     def __new__(cls, data, header=None):
-        obj = np.asarray(data).view(cls)
+        if not isinstance(data, np.ndarray):
+            data = np.asarray(data)
+        obj = data.view(cls)
         obj.header = header
         return obj
 
@@ -21,11 +24,43 @@ class HduArray(np.ndarray):
         if obj is not None:
             self.header = getattr(obj, 'header', None)
 
+    def strip_strings(self):
+        '''Strip trailing spaces from the string fields of a table.
+
+        FITS character fields (TFORM ``A``) are padded with spaces.  The
+        fields are stripped in place if the array is writeable, otherwise
+        a copy is stripped and returned.  Arrays without string fields are
+        returned as they are.
+
+        '''
+        names = [name for name in self.dtype.names or ()
+                 if self.dtype[name].kind in 'SU']
+        if not names:
+            return self
+        out = self if self.flags.writeable else self.copy()
+        for name in names:
+            out[name] = np.char.rstrip(out[name])
+        return out
+
+    def as_native(self):
+        '''Return a copy in native byte order.
+
+        The data is byte-swapped once in a single vectorised copy, and
+        table fields are aligned for fast access.
+
+        '''
+        return self.astype(native_dtype(self.dtype))
+
+
+NAXIS_KEYWORDS = tuple(f'NAXIS{i}' for i in range(1, 1000))
+
 
 def shape_from_header(header):
     naxis = header['NAXIS']
-    if naxis > 0:
-        shape = tuple(header[f'NAXIS{i+1}'] for i in range(naxis))
+    if naxis > 1:
+        shape = itemgetter(*NAXIS_KEYWORDS[:naxis])(header)
+    elif naxis == 1:
+        shape = (header['NAXIS1'],)
     else:
         shape = None
     return shape
@@ -38,13 +73,13 @@ tform_regex = re.compile(r'''
 ''', re.X)
 
 
-BITPIX_DTYPE_MAP = {
-    8: 'u1',
-    16: 'i2',
-    32: 'i4',
-    64: 'i8',
-    -32: 'f4',
-    -64: 'f8',
+BITPIX_INFO = {
+    8: (1, '>u1'),
+    16: (2, '>i2'),
+    32: (4, '>i4'),
+    64: (8, '>i8'),
+    -32: (4, '>f4'),
+    -64: (8, '>f8'),
 }
 
 
@@ -55,7 +90,7 @@ TFORM_DTYPE_MAP = {
     'I': 'i2',
     'J': 'i4',
     'K': 'i8',
-    'A': 'U',
+    'A': 'S1',
     'E': 'f4',
     'D': 'f8',
     'C': 'c8',
@@ -63,44 +98,73 @@ TFORM_DTYPE_MAP = {
 }
 
 
-def image_dtype(header):
+def bitpix_info(header):
     bitpix = header['BITPIX']
     try:
-        dtype = BITPIX_DTYPE_MAP[bitpix]
+        return BITPIX_INFO[bitpix]
     except KeyError:
         raise ValueError(f'invalid BITPIX value: {bitpix}') from None
-    return f'>{dtype}'
 
 
-def bintable_dtype(header):
-    dtype = []
-    tfields = header['TFIELDS']
-    for n in range(tfields):
-        ttype = header.get(f'TTYPE{n+1}', f'f{n}')
-        tform = header[f'TFORM{n+1}']
+def image_dtype(header):
+    return bitpix_info(header)[1]
+
 
-        name = ttype.rstrip()
+@lru_cache(maxsize=1024)
+def field_dtype(ttype, tform):
+    name = ttype.rstrip()
 
-        if (m := tform_regex.fullmatch(tform)) is None:
-            raise ValueError(f'TFORM{n+1}: invalid format: {tform}')
-        count, value = m.group('count'), m.group('value')
+    if (m := tform_regex.fullmatch(tform)) is None:
+        raise ValueError(f'invalid format: {tform}')
+    count, value = m.group('count'), m.group('value')
 
-        fmt = TFORM_DTYPE_MAP[value]
+    fmt = TFORM_DTYPE_MAP[value]
 
-        if count is not None:
-            if value == 'X':
-                c = int(count)
-                if c % 8:
-                    c += 1
-                fmt = f'{c}{fmt}'
-            elif value == 'A':
-                fmt = f'{fmt}{count}'
-            else:
-                fmt = f'{count}{fmt}'
+    if count is not None:
+        if value == 'X':
+            # bits are packed into bytes
+            c = (int(count) + 7) // 8
+            fmt = f'{c}{fmt}'
+        elif value == 'A':
+            fmt = f'S{count}'
+        else:
+            fmt = f'{count}{fmt}'
 
-        dtype += [(name, f'>{fmt}')]
+    return name, np.dtype(f'>{fmt}')
 
-    return dtype
+
+def bintable_dtype(header):
+    names, formats, offsets = [], [], []
+    offset = 0
+    tfields = header['TFIELDS']
+    for n in range(tfields):
+        ttype = header.get(f'TTYPE{n+1}', f'f{n}')
+        tform = header[f'TFORM{n+1}']
+        try:
+            name, fmt = field_dtype(ttype, tform)
+        except ValueError as exc:
+            raise ValueError(f'TFORM{n+1}: {exc}') from None
+        # blank TTYPE values are allowed, name the field by position
+        names.append(name or f'f{n}')
+        formats.append(fmt)
+        offsets.append(offset)
+        offset += fmt.itemsize
+
+    # the row width is given explicitly by NAXIS1
+    return np.dtype({
+        'names': names,
+        'formats': formats,
+        'offsets': offsets,
+        'itemsize': header['NAXIS1'],
+    })
+
+
+def native_dtype(dtype):
+    '''Native byte order version of dtype, with aligned fields.'''
+    if dtype.names is None:
+        return dtype.newbyteorder('=')
+    return np.dtype([(name, dtype.fields[name][0].newbyteorder('='))
+                     for name in dtype.names], align=True)
 
 
 def dtype_from_header(header):
@@ -113,88 +177,101 @@ def dtype_from_header(header):
     else:
         raise ValueError(f'{kind} extension not supported')
 
-    return dtype
+    return np.dtype(dtype)
 
 
-def skip_data(fp, header):
+def data_size(header):
+    '''Size of the data unit in bytes, including padding.'''
     shape = shape_from_header(header)
-    if shape is not None:
-        bitpix = header['BITPIX']
-        pcount = header.get('PCOUNT', 0)
-        ndata = abs(bitpix)//8 * (pcount + math.prod(shape))
-        nskip = ndata + (2880 - ndata % 2880) % 2880
-        fp.seek(nskip, 1)
-
-
-def hdu(fp, header):
+    if shape is None:
+        return 0
+    itemsize = bitpix_info(header)[0]
+    pcount = header.get('PCOUNT', 0)
+    size = 1
+    for n in shape:
+        size *= n
+    ndata = itemsize * (pcount + size)
+    return ndata + (2880 - ndata % 2880) % 2880
+
+
+def hdu(buffer, offset, header, native_endian=False):
     shape = shape_from_header(header)
     dtype = dtype_from_header(header)
-    buffer = data = None
 
     if shape is not None:
 
-        bitpix = header['BITPIX']
-        pcount = header.get('PCOUNT', 0)
-        gcount = header.get('GCOUNT', 1)
-
-        nbytes = abs(bitpix)//8 * gcount * (pcount + math.prod(shape))
-
-        if isinstance(dtype, list):
+        if dtype.names is not None:
             shape = shape[1:]
 
-        file_offset = fp.tell()
+        data = np.ndarray(shape, dtype, buffer=buffer, offset=offset,
+                          order='F')
 
-        array_offset = file_offset % mmap.ALLOCATIONGRANULARITY
+    else:
 
-        buffer_offset = file_offset - array_offset
-        buffer_length = array_offset + nbytes
+        data = np.empty(0, dtype)
 
-        try:
+    data = HduArray(data, header)
 
-            buffer = mmap.mmap(fp.fileno(), buffer_length,
-                               offset=buffer_offset, access=mmap.ACCESS_READ)
+    if native_endian:
+        data = data.as_native()
 
-            data = np.ndarray.__new__(np.ndarray, shape, dtype,
-                                      buffer=buffer, offset=array_offset,
-                                      order='F')
+    return data
 
-        finally:
 
-            if buffer is not None and data is None:
-                buffer.close()
+def map_file(fp, prefault=False):
+    '''Map the entire file read-only, optionally prefaulting its pages.'''
+    if prefault and hasattr(mmap, 'MAP_POPULATE'):
+        return mmap.mmap(fp.fileno(), 0,
+                         flags=mmap.MAP_SHARED | mmap.MAP_POPULATE,
+                         prot=mmap.PROT_READ)
+    return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
 
-        finalize(data, buffer.close)
 
-    else:
+def load(fp, prefault=False, keep_comments=False, native_endian=False):
+    '''Load all HDUs from a FITS file as memory-mapped arrays.
 
-        data = np.empty(0, dtype)
+    If *prefault* is true, the file is paged in when it is mapped (using
+    ``MAP_POPULATE`` where available), which is faster if the data will
+    be read in its entirety.
+
+    Reading starts at the current position of *fp*.
 
-    return HduArray(data, header)
+    COMMENT and HISTORY records are not included in the headers unless
+    *keep_comments* is true.
 
+    If *native_endian* is true, the data is copied into memory in native
+    byte order, instead of being mapped from the (big-endian) file.
 
-def load(fp):
+    '''
     hdus = []
 
-    buffer = bytearray(2880)
+    # empty files cannot be mapped
+    if os.fstat(fp.fileno()).st_size == 0:
+        raise TypeError('not a FITS file')
+
+    # map the entire file once; the arrays keep a reference to the mapping
+    buffer = map_file(fp, prefault)
 
     try:
-        header = read_header(fp, buffer)
+        header, offset = read_header(buffer, fp.tell(),
+                                     keep_comments=keep_comments)
     except HDUError:
         raise TypeError('not a FITS file')
 
-    hdus.append(hdu(fp, header))
+    hdus.append(hdu(buffer, offset, header, native_endian))
 
     if header['EXTEND'] is True:
 
         while True:
 
-            skip_data(fp, header)
+            offset += data_size(header)
 
             try:
-                header = read_header(fp, buffer, False)
+                header, offset = read_header(buffer, offset, False,
+                                             keep_comments)
             except HDUError:
                 break
 
-            hdus.append(hdu(fp, header))
+            hdus.append(hdu(buffer, offset, header, native_endian))
 
     return hdus
@@ -1,143 +1,178 @@
 '''FITS header reader'''
 
 import re
-from enum import Enum
+from collections import defaultdict
+
+import numpy as np
 
 
 class HDUError(TypeError):
     pass
 
 
-class KeywordValue(str, Enum):
-    '''Grammar for FITS keyword values.
+# Grammar for FITS keyword values.
+# Based on Appendix A of the FITS Standard Document v4.0.
 
-    Based on Appendix A of the FITS Standard Document v4.0.
+VALUE_STR = r"' (?: [ -&(-~] | '' )* '"
 
-    '''
+VALUE_BOOL = r'[TF]'
 
-    __str__ = str.__str__
+VALUE_INT = r'[-+]? [0-9]+'
 
-    STR = '(?: \' [ -~]* \' )+'
+VALUE_FLOAT = r'''
+    [-+]? (?: [0-9]+ \.? | [0-9]* \. [0-9]+ )   # decimal
+    (?: [ED] [-+]? [0-9]+ )?                    # exponent
+'''
 
-    BOOL = '[TF]'
+VALUE_NUMBER = fr'(?P<int> {VALUE_INT}) | (?P<float> {VALUE_FLOAT})'
 
-    INT = '[-+]? [0-9]+'
+VALUE_COMPLEX = fr'''
+    \( \ * (?P<real> {VALUE_FLOAT} ) \ * ,   # real part
+    \ * (?P<imag> {VALUE_FLOAT} ) \ * \)     # imaginary part
+'''
 
-    FLOAT = r'''
-        [-+]? (?: [0-9]+ \.? | [0-9]* \. [0-9]+ )   # decimal
-        (?: [ED] [-+]? [0-9]+ )?                    # exponent
-    '''
+COMMENT = r'(?: / (?P<comment> [ -~]* ) )'
 
-    COMPLEX = fr'''
-        \( \ * (?P<real> {FLOAT} ) \ * ,   # real part
-        \ * (?P<imag> {FLOAT} ) \ * \)     # imaginary part
-    '''
 
-    VALUE = f'''
-        (?P<value>
-            (?P<string> {STR}) |
-            (?P<bool> {BOOL}) |
-            (?P<int> {INT}) |
-            (?P<float> {FLOAT}) |
-            (?P<complex> {COMPLEX})
-        )
-    '''
+def value_regex(value):
+    expr = fr'(?P<value> {value} )? \ * {COMMENT}?'
+    return re.compile(expr.encode('ascii'), re.X)
+
+
+string_regex = value_regex(VALUE_STR)
+
+bool_regex = value_regex(VALUE_BOOL)
+
+number_regex = value_regex(VALUE_NUMBER)
+
+complex_regex = value_regex(VALUE_COMPLEX)
+
+error_keyword_regex = re.compile(rb'(\w+)\s*')
+
+# characters allowed in header records
+PRINTABLE = bytes(range(32, 127))
+
+# keywords whose records are comments, and which have no value indicator
+COMMENT_KEYWORDS = frozenset((b'COMMENT', b'HISTORY'))
+COMMENTARY_KEYWORDS = COMMENT_KEYWORDS | {b''}
+
 
-    COMMENT = '(?: / (?P<comment> [ -~]* ) )'
+def parse_string(m):
+    return m.group('value')[1:-1].replace(b"''", b"'").decode('ascii')
 
-    PARSE = fr'\ * {VALUE}? \ * {COMMENT}?'
 
+def parse_bool(m):
+    return m.group('value') == b'T'
 
-keyword_value_regex = re.compile(KeywordValue.PARSE, re.X)
+
+def parse_number(m):
+    if (i := m.group('int')) is not None:
+        return int(i)
+    return float(m.group('float').replace(b'D', b'E'))
+
+
+def parse_complex(m):
+    return complex(float(m.group('real')), float(m.group('imag')))
+
+
+# regex and parser for values, selected by their first character
+VALUE_PARSERS = {
+    b"'": (string_regex, parse_string),
+    b'T': (bool_regex, parse_bool),
+    b'F': (bool_regex, parse_bool),
+    b'(': (complex_regex, parse_complex),
+    **dict.fromkeys([b'+', b'-', b'.', *(b'%d' % i for i in range(10))],
+                    (number_regex, parse_number)),
+}
 
 
 def parse_keyword_value(expr):
-    m = keyword_value_regex.fullmatch(expr)
+    expr = expr.lstrip(b' ')
+
+    # without a known first character, there can only be a comment,
+    # which is matched by any of the regexes with the value left out
+    regex, parse = VALUE_PARSERS.get(expr[:1], (string_regex, None))
+
+    m = regex.fullmatch(expr)
 
     if m is None:
         raise ValueError('invalid keyword value')
     elif m.group('value') is None:
         value = None
-    elif (s := m.group('string')) is not None:
-        value = s[1:-1].replace("''", "'")
-    elif (b := m.group('bool')) is not None:
-        value = (b == 'T')
-    elif (i := m.group('int')) is not None:
-        value = int(i)
-    elif (f := m.group('float')) is not None:
-        value = float(f.replace('D', 'E'))
-    elif m.group('complex') is not None:
-        real, imag = m.group('real'), m.group('imag')
-        value = complex(float(real), float(imag))
     else:
-        # should never happen
-        value = None
+        value = parse(m)
 
     if (co := m.group('comment')) is not None:
-        comment = co.strip()
+        comment = co.strip().decode('ascii')
     else:
         comment = None
 
     return value, comment
 
 
-def parse_keyword(record):
-    keyword = record[:8].rstrip(' ')
+def parse_keyword(record, keep_comments=False):
+    keyword = record[:8].rstrip(b' ')
+
+    if keyword == b'END':
+        return None, None, None
 
-    if keyword == 'END':
-        keyword, value, comment = None, None, None
+    elif not keep_comments and keyword in COMMENT_KEYWORDS:
+        value, comment = None, None
 
-    elif (keyword == 'CONTINUE'
-          or keyword not in ('COMMENT', 'HISTORY', '')
-          and record[8:10] == '= '):
+    elif (keyword == b'CONTINUE'
+          or keyword not in COMMENTARY_KEYWORDS
+          and record[8:10] == b'= '):
 
         value, comment = parse_keyword_value(record[10:])
 
     else:
 
-        value, comment = record[8:].rstrip(' '), None
+        value, comment = record[8:].rstrip(b' ').decode('ascii'), None
 
-    return keyword, value, comment
+    return keyword.decode('ascii'), value, comment
 
 
-def read_block(fp, buffer=None):
-    if buffer is None or len(buffer) != 2880:
-        buffer = bytearray(2880)
-    size = fp.readinto(buffer)
-    if size != 2880:
-        buffer = None
-    return buffer
+def read_header(buffer, offset=0, primary=True, keep_comments=False):
+    '''Read the header at the given offset of the buffer.
 
+    Returns the header keywords and the offset of the block following the
+    header.  COMMENT and HISTORY records are skipped unless *keep_comments*
+    is true.
 
-def read_header(fp, buffer=None, primary=True):
+    '''
     keywords = {}
+    counts = defaultdict(int)
     nrecords = 0
 
+    # local names for the inner loop
+    parse = parse_keyword
+    frombuffer = np.frombuffer
+
     ended = False
     while not ended:
 
-        block = read_block(fp, buffer)
+        block = buffer[offset:offset+2880]
+        offset += 2880
 
-        if block is None:
+        if len(block) != 2880:
             if nrecords == 0:
                 raise HDUError
             else:
                 raise TypeError('incomplete block in header')
 
-        if min(block) < 32 or max(block) > 126:
+        if block.translate(None, PRINTABLE):
             raise TypeError('invalid characters in header')
 
-        for i in range(0, 2880, 80):
-            record = block[i:i+80].decode('ascii')
+        for record in frombuffer(block, dtype='S80').tolist():
             nrecords += 1
 
             try:
-                keyword, value, comment = parse_keyword(record)
+                keyword, value, comment = parse(record, keep_comments)
             except ValueError as exc:
                 if nrecords == 1:
                     raise HDUError
-                if (m := re.fullmatch(r'(\w+)\s*', record[:8])):
-                    msg = f' [{m.group(1)}?]'
+                if (m := error_keyword_regex.fullmatch(record[:8])):
+                    msg = f' [{m.group(1).decode()}?]'
                 else:
                     msg = ''
                 raise ValueError(f'record {nrecords}{msg}: {exc}') from None
@@ -156,11 +191,11 @@ def read_header(fp, buffer=None, primary=True):
 
             # TODO: keep comment
             if value is not None:
-                ndup = 0
-                name = keyword
-                while name in keywords:
-                    ndup += 1
-                    name = f'{keyword}.{ndup}'
-                keywords[name] = value
-
-    return keywords
+                ndup = counts[keyword]
+                counts[keyword] = ndup + 1
+                if ndup > 0:
+                    keywords[f'{keyword}.{ndup}'] = value
+                else:
+                    keywords[keyword] = value
+
+    return keywords, offset